@@ -3,3 +3,60 @@
 #
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
+
+import os
+import subprocess
+from typing import List
+
+import pytest
+
+
+def _visible_gpus() -> List[str]:
+    """
+    List the GPUs visible to this process without initializing CUDA, since
+    ``CUDA_VISIBLE_DEVICES`` only takes effect if it is set before CUDA is initialized.
+    """
+    visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible_devices is not None:
+        return [gpu for gpu in visible_devices.split(",") if gpu]
+    try:
+        output = subprocess.check_output(
+            ["nvidia-smi", "--query-gpu=index", "--format=csv,noheader"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return [line.strip() for line in output.splitlines() if line.strip()]
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    """
+    When running under pytest-xdist (e.g. ``pytest -n 4 --dist=loadgroup tests``), pin each
+    worker to its own pair of GPUs so that 2-rank NCCL tests on different workers run concurrently.
+    Test classes which share a process group across methods are kept on one worker, see
+    :func:`pytest_collection_modifyitems`.
+    """
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker_id is None:
+        return
+    gpus = _visible_gpus()
+    num_pairs = len(gpus) // 2
+    if num_pairs < 2:
+        return
+    pair = int(worker_id[len("gw") :]) % num_pairs
+    os.environ["CUDA_VISIBLE_DEVICES"] = f"{gpus[2 * pair]},{gpus[2 * pair + 1]}"
+
+
+def pytest_collection_modifyitems(items: List[pytest.Item]) -> None:
+    """
+    Put all methods of a test class which keeps its ``MultiProcessTestRunner`` workers in
+    ``_runners`` into the same ``xdist_group``, so that ``--dist=loadgroup`` runs them on
+    one worker and the workers are only spawned once.
+    """
+    for item in items:
+        cls = getattr(item, "cls", None)
+        if cls is not None and hasattr(cls, "_runners"):
+            item.add_marker(
+                pytest.mark.xdist_group(name=f"{cls.__module__}.{cls.__qualname__}")
+            )
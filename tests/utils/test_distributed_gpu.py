@@ -34,10 +34,12 @@ class DistributedGPUTest(unittest.TestCase):
     def _test_ddp_gather_uneven_tensors_multidim_nccl() -> None:
         rank = dist.get_rank()
         world_size = dist.get_world_size()
-        tensor = torch.ones(rank + 1, 4 - rank, device=get_device_from_env())
+        device = get_device_from_env()
+        tensor = torch.empty((rank + 1, 4 - rank), device=device).fill_(1.0)
+
         result = all_gather_tensors(tensor)
         assert len(result) == world_size
         for idx in range(world_size):
-            val = result[idx]
-            assert val.shape == (idx + 1, 4 - idx)
-            assert (val == 1).all()
+            assert result[idx].shape == (idx + 1, 4 - idx)
+        flat = torch.cat([val.reshape(-1) for val in result])
+        assert torch.equal(flat, torch.ones_like(flat))
@@ -5,10 +5,17 @@
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
 
+import copy
+import re
+import traceback
 import unittest
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional, Type, Union
 from unittest.mock import patch
 
 import torch
+import torch.distributed as dist
 from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 from torch.distributed.fsdp.fully_sharded_data_parallel import MixedPrecision
 from torch.nn.parallel import DistributedDataParallel as DDP
@@ -23,95 +30,149 @@ from torchtnt.utils.prepare_module import (
     SWAParams,
     TorchCompileParams,
 )
-from torchtnt.utils.test_utils import spawn_multi_process
+from torchtnt.utils.test_utils import MultiProcessTestRunner
 from torchtnt.utils.version import is_torch_version_geq_1_13, is_torch_version_geq_2_0
 
-COMPILE_AVAIL = False
-if is_torch_version_geq_1_13():
-    COMPILE_AVAIL = True
-    import torch._dynamo
+# torch._dynamo is heavy to import, so it is only imported by the tests which compile
+COMPILE_AVAIL: bool = is_torch_version_geq_1_13()
 
 if is_torch_version_geq_2_0():
     from torch.distributed._composable import fully_shard
 
+_NUM_GPUS: int = torch.cuda.device_count() if torch.cuda.is_available() else 0
+
+_cached_device: Optional[torch.device] = None
+
+
+@contextmanager
+def _raises_regex(
+    expected_exception: Type[BaseException], expected_regex: str
+) -> Iterator[None]:
+    """
+    Lightweight ``assertRaisesRegex`` for worker processes, which avoids building a ``unittest.TestCase``.
+    """
+    try:
+        yield
+    except expected_exception as e:
+        if not re.search(expected_regex, str(e)):
+            raise AssertionError(f'"{expected_regex}" does not match "{e}"') from e
+    else:
+        raise AssertionError(f"{expected_exception.__name__} not raised")
+
+
+def _device() -> torch.device:
+    """
+    Memoized ``init_from_env``. The device never changes within a (worker) process,
+    so there is no need to query the environment and set the CUDA device again for every test.
+    """
+    global _cached_device
+    if _cached_device is None:
+        _cached_device = init_from_env()
+    return _cached_device
+
 
 class PrepareModelTest(unittest.TestCase):
 
     cuda_available: bool = torch.cuda.is_available()
     distributed_available: bool = torch.distributed.is_available()
+    _runners: Dict[str, MultiProcessTestRunner] = {}
+    _linear_template: Optional[torch.nn.Module] = None
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        for runner in cls._runners.values():
+            runner.shutdown()
+        cls._runners.clear()
+
+    @classmethod
+    def _start_runner(cls, backend: str) -> MultiProcessTestRunner:
+        if backend not in cls._runners:
+            cls._runners[backend] = MultiProcessTestRunner(2, backend)
+        return cls._runners[backend]
+
+    @classmethod
+    def _run_multi_process(cls, backend: str, test_method: Callable[[], Any]) -> None:
+        """
+        Run ``test_method`` on 2 ranks, reusing the process group of earlier tests with the same backend.
+        Workers are only spawned by the first test that needs them, so skipped tests never pay for them.
+        """
+        cls._start_runner(backend).run(test_method)
+
+    @classmethod
+    def _make_linear(cls) -> torch.nn.Module:
+        """
+        Return a fresh ``torch.nn.Linear(2, 2)`` on CPU. DDP/FSDP and compile mutate the module,
+        so each test gets its own copy, but copying the template is cheaper than initializing parameters.
+        The parameters are left uninitialized, since these tests never look at their values.
+        """
+        if cls._linear_template is None:
+            cls._linear_template = torch.nn.utils.skip_init(torch.nn.Linear, 2, 2)
+        return copy.deepcopy(cls._linear_template)
+
+    @staticmethod
+    def _run_subtests(*subtests: Callable[[], None]) -> None:
+        """
+        Run several subtests in the same process group, separated by barriers.
+        Every subtest runs even if an earlier one fails; failures are raised together at the end.
+        """
+        errors = []
+        for subtest in subtests:
+            try:
+                subtest()
+            except Exception:
+                name = getattr(subtest, "__name__", repr(subtest))
+                errors.append(f"{name}:\n{traceback.format_exc()}")
+            dist.barrier()
+        if errors:
+            raise AssertionError("\n".join(errors))
 
-    @unittest.skipUnless(
-        condition=(cuda_available), reason="This test should run on a GPU host."
-    )
     @unittest.skipUnless(
         distributed_available, reason="Torch distributed is needed to run"
     )
     def test_prepare_ddp(self) -> None:
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_prepare_ddp,
-        )
+        self._run_multi_process("gloo", self._test_prepare_ddp)
 
     @staticmethod
     def _test_prepare_ddp() -> None:
-        module = torch.nn.Linear(2, 2)
-        device = init_from_env()
+        module = PrepareModelTest._make_linear()
+        # only checks wrapping, so run on CPU with gloo to avoid the NCCL bootstrap
+        device = torch.device("cpu")
         ddp_module = prepare_ddp(
             module,
             device,
             DDPStrategy(find_unused_parameters=True, gradient_as_bucket_view=True),
         )
-        tc = unittest.TestCase()
-        tc.assertTrue(isinstance(ddp_module, DDP))
+        assert isinstance(ddp_module, DDP)
 
     @unittest.skipUnless(
-        condition=(cuda_available), reason="This test should run on a GPU host."
+        condition=_NUM_GPUS >= 2,
+        reason="This test needs 2 GPUs to run.",
     )
     @unittest.skipUnless(
         distributed_available, reason="Torch distributed is needed to run"
     )
     def test_prepare_fsdp(self) -> None:
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_prepare_fsdp,
-        )
+        self._run_multi_process("nccl", self._test_prepare_fsdp)
 
     @staticmethod
     def _test_prepare_fsdp() -> None:
-        module = torch.nn.Linear(2, 2)
-        device = init_from_env()
+        module = PrepareModelTest._make_linear()
+        device = _device()
         fsdp_module = prepare_fsdp(module, device, FSDPStrategy(limit_all_gathers=True))
-        tc = unittest.TestCase()
-        tc.assertTrue(isinstance(fsdp_module, FSDP))
+        assert isinstance(fsdp_module, FSDP)
 
-    @unittest.skipUnless(
-        distributed_available, reason="Torch distributed is needed to run"
-    )
-    @unittest.skipUnless(
-        condition=cuda_available, reason="This test needs a GPU host to run."
-    )
     def test_fsdp_pytorch_version(self) -> None:
         """
         Test that a RuntimeError is thrown when using FSDP, and PyTorch < v1.12
         """
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_fsdp_pytorch_version,
-        )
-
-    @staticmethod
-    def _test_fsdp_pytorch_version() -> None:
-        device = init_from_env()
-        module = torch.nn.Linear(2, 2).to(device)
-
-        tc = unittest.TestCase()
+        # prepare_fsdp raises before touching the process group or the device, so no
+        # workers are needed, and CUDA must not be initialized in the test process
+        device = torch.device("cpu")
+        module = self._make_linear()
         with patch(
             "torchtnt.utils.prepare_module.is_torch_version_geq_1_12",
             return_value=False,
-        ), tc.assertRaisesRegex(
+        ), self.assertRaisesRegex(
             RuntimeError,
             "Please install PyTorch 1.12 or higher to use FSDP: https://pytorch.org/get-started/locally/",
         ):
@@ -119,11 +180,11 @@ class PrepareModelTest(unittest.TestCase):
 
     @staticmethod
     def _test_is_fsdp_module() -> None:
-        model = torch.nn.Linear(1, 1)
+        model = torch.nn.utils.skip_init(torch.nn.Linear, 1, 1)
         assert not _is_fsdp_module(model)
-        model = FSDP(torch.nn.Linear(1, 1))
+        model = FSDP(torch.nn.utils.skip_init(torch.nn.Linear, 1, 1))
         assert _is_fsdp_module(model)
-        model = torch.nn.Linear(1, 1)
+        model = torch.nn.utils.skip_init(torch.nn.Linear, 1, 1)
         if is_torch_version_geq_2_0():
             fully_shard(model)
             assert _is_fsdp_module(model)
@@ -131,48 +192,35 @@ class PrepareModelTest(unittest.TestCase):
     @unittest.skipUnless(
         distributed_available, reason="Torch distributed is needed to run"
     )
-    # pyre-fixme[56]: Pyre was not able to infer the type of argument
-    #  `torch.cuda.is_available() and torch.cuda.device_count() > 2` to decorator
-    #  factory `unittest.skipUnless`.
     @unittest.skipUnless(
-        condition=cuda_available and torch.cuda.device_count() >= 2,
+        condition=_NUM_GPUS >= 2,
         reason="This test needs 2 GPUs to run.",
     )
     def test_is_fsdp_module(self) -> None:
-        spawn_multi_process(
-            2,
-            "gloo",
-            self._test_is_fsdp_module,
-        )
+        self._run_multi_process("gloo", self._test_is_fsdp_module)
 
     @unittest.skipUnless(
         distributed_available, reason="Torch distributed is needed to run"
     )
     @unittest.skipUnless(
-        condition=cuda_available, reason="This test needs a GPU host to run."
+        condition=_NUM_GPUS >= 2,
+        reason="This test needs 2 GPUs to run.",
     )
     def test_fdsp_precision(self) -> None:
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_fdsp_precision,
-        )
+        self._run_multi_process("nccl", self._test_fdsp_precision)
 
     @staticmethod
     def _test_fdsp_precision() -> None:
-        module = torch.nn.Linear(1, 1)
-        device = init_from_env()
+        module = torch.nn.utils.skip_init(torch.nn.Linear, 1, 1)
+        device = _device()
         mixed_precision = MixedPrecision(
             param_dtype=torch.float64,
         )
         fsdp_module = prepare_fsdp(
             module, device, FSDPStrategy(mixed_precision=mixed_precision)
         )
-        tc = unittest.TestCase()
-        tc.assertTrue(isinstance(fsdp_module, FSDP))
-        tc.assertEqual(
-            fsdp_module.mixed_precision.param_dtype, mixed_precision.param_dtype
-        )
+        assert isinstance(fsdp_module, FSDP)
+        assert fsdp_module.mixed_precision.param_dtype == mixed_precision.param_dtype
 
     # test strategy options
     def test_prepare_module_strategy_invalid_str(self) -> None:
@@ -182,8 +230,8 @@ class PrepareModelTest(unittest.TestCase):
 
         with self.assertRaisesRegex(ValueError, "Strategy foo not supported"):
             prepare_module(
-                module=torch.nn.Linear(2, 2),
-                device=init_from_env(),
+                module=self._make_linear(),
+                device=_device(),
                 strategy="foo",
             )
 
@@ -191,72 +239,53 @@ class PrepareModelTest(unittest.TestCase):
         distributed_available, reason="Torch distributed is needed to run"
     )
     @unittest.skipUnless(
-        condition=cuda_available, reason="This test needs a GPU host to run."
+        condition=_NUM_GPUS >= 2,
+        reason="This test needs 2 GPUs to run.",
     )
     def test_prepare_module_with_fsdp(self) -> None:
         """
         Launch tests of FSDP strategy
         """
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_prepare_module_fsdp_strategy_wrapped_in_fsdp,
-        )
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_prepare_module_fsdp_string_wrapped_in_fsdp,
-        )
-        spawn_multi_process(
-            2,
-            "nccl",
-            self._test_stochastic_weight_averaging_with_fsdp_raises,
-        )
+        self._run_multi_process("nccl", self._test_prepare_module_fsdp_all)
 
     @staticmethod
-    def _test_prepare_module_fsdp_strategy_wrapped_in_fsdp() -> None:
-        """
-        Test that the module is correctly wrapped in FSDP
-        """
-
-        fsdp_module = prepare_module(
-            module=torch.nn.Linear(2, 2),
-            device=init_from_env(),
-            strategy=FSDPStrategy(),
+    def _test_prepare_module_fsdp_all() -> None:
+        PrepareModelTest._run_subtests(
+            partial(
+                PrepareModelTest._test_prepare_module_fsdp_wrapped_in_fsdp,
+                FSDPStrategy(),
+            ),
+            partial(PrepareModelTest._test_prepare_module_fsdp_wrapped_in_fsdp, "fsdp"),
+            PrepareModelTest._test_stochastic_weight_averaging_with_fsdp_raises,
         )
-        tc = unittest.TestCase()
-
-        tc.assertTrue(isinstance(fsdp_module, FSDP))
 
     @staticmethod
-    def _test_prepare_module_fsdp_string_wrapped_in_fsdp() -> None:
+    def _test_prepare_module_fsdp_wrapped_in_fsdp(
+        strategy: Union[str, FSDPStrategy]
+    ) -> None:
         """
-        Test that the module is correctly wrapped in FSDP when passing "fsdp" as a string
+        Test that the module is correctly wrapped in FSDP, whether the strategy is passed as a FSDPStrategy or as "fsdp"
         """
 
         fsdp_module = prepare_module(
-            module=torch.nn.Linear(2, 2),
-            device=init_from_env(),
-            strategy="fsdp",
+            module=PrepareModelTest._make_linear(),
+            device=_device(),
+            strategy=strategy,
         )
-        tc = unittest.TestCase()
-
-        tc.assertTrue(isinstance(fsdp_module, FSDP))
+        assert isinstance(fsdp_module, FSDP)
 
     @staticmethod
     def _test_stochastic_weight_averaging_with_fsdp_raises() -> None:
         """
         Test that a RuntimeError is thrown when attempting to use Stochastic Weight Averaging and FSDP
         """
-
-        tc = unittest.TestCase()
-        with tc.assertRaisesRegex(
+        with _raises_regex(
             RuntimeError,
             "Stochastic Weight Averaging is currently not supported with the FSDP strategy",
         ):
             prepare_module(
-                module=torch.nn.Linear(2, 2),
-                device=init_from_env(),
+                module=PrepareModelTest._make_linear(),
+                device=_device(),
                 strategy=FSDPStrategy(),
                 swa_params=SWAParams(epoch_start=1, anneal_epochs=5),
             )
@@ -269,66 +298,46 @@ class PrepareModelTest(unittest.TestCase):
         Launch tests of DDP strategy
         """
 
-        spawn_multi_process(
-            2,
-            "gloo",
-            self._test_prepare_module_ddp_strategy_wrapped_in_ddp,
-        )
-        spawn_multi_process(
-            2,
-            "gloo",
-            self._test_prepare_module_ddp_string_wrapped_in_ddp,
-        )
-        spawn_multi_process(
-            2,
-            "gloo",
-            self._test_prepare_module_ddp_throws_with_compile_params_and_static_graph,
-        )
+        self._run_multi_process("gloo", self._test_prepare_module_ddp_all)
 
     @staticmethod
-    def _test_prepare_module_ddp_strategy_wrapped_in_ddp() -> None:
-        """
-        Test that the module is correctly wrapped in DDP
-        """
-
-        ddp_module = prepare_module(
-            module=torch.nn.Linear(2, 2),
-            device=init_from_env(),
-            strategy=DDPStrategy(),
+    def _test_prepare_module_ddp_all() -> None:
+        PrepareModelTest._run_subtests(
+            partial(
+                PrepareModelTest._test_prepare_module_ddp_wrapped_in_ddp,
+                DDPStrategy(),
+            ),
+            partial(PrepareModelTest._test_prepare_module_ddp_wrapped_in_ddp, "ddp"),
+            PrepareModelTest._test_prepare_module_ddp_throws_with_compile_params_and_static_graph,
         )
-        tc = unittest.TestCase()
-
-        tc.assertTrue(isinstance(ddp_module, DDP))
 
     @staticmethod
-    def _test_prepare_module_ddp_string_wrapped_in_ddp() -> None:
+    def _test_prepare_module_ddp_wrapped_in_ddp(
+        strategy: Union[str, DDPStrategy]
+    ) -> None:
         """
-        Test that the module is correctly wrapped in DDP when passing "ddp" as a string
+        Test that the module is correctly wrapped in DDP, whether the strategy is passed as a DDPStrategy or as "ddp"
         """
 
         ddp_module = prepare_module(
-            module=torch.nn.Linear(2, 2),
-            device=init_from_env(),
-            strategy="ddp",
+            module=PrepareModelTest._make_linear(),
+            device=_device(),
+            strategy=strategy,
         )
-        tc = unittest.TestCase()
-
-        tc.assertTrue(isinstance(ddp_module, DDP))
+        assert isinstance(ddp_module, DDP)
 
     @staticmethod
     def _test_prepare_module_ddp_throws_with_compile_params_and_static_graph() -> None:
         """
         Test that we throw an exception when we are using DDP static graph with compile params
         """
-
-        tc = unittest.TestCase()
-        with tc.assertRaisesRegex(
+        with _raises_regex(
             RuntimeError,
             "Torch compile requires DDPStrategy's static_graph to be False",
         ):
             prepare_module(
-                module=torch.nn.Linear(2, 2),
-                device=init_from_env(),
+                module=PrepareModelTest._make_linear(),
+                device=_device(),
                 strategy=DDPStrategy(static_graph=True),
                 torch_compile_params=TorchCompileParams(backend="inductor"),
             )
@@ -341,7 +350,10 @@ class PrepareModelTest(unittest.TestCase):
         condition=cuda_available, reason="This test needs a GPU host to run."
     )
     def test_prepare_module_compile_module_state_dict(self) -> None:
-        device = init_from_env()
+        import torch._dynamo  # noqa
+
+        device = _device()
+        # the state dicts are compared by value, so initialize the parameters
         my_module = torch.nn.Linear(2, 2, device=device)
         my_module_state_dict = my_module.state_dict()
         self.assertIsNone(my_module._compiled_call_impl)
@@ -352,10 +364,14 @@ class PrepareModelTest(unittest.TestCase):
         )
         compiled_state_dict = compiled_module.state_dict()
         self.assertCountEqual(compiled_state_dict.keys(), my_module_state_dict.keys())
-        for k in compiled_state_dict.keys():
-            self.assertTrue(
-                torch.allclose(my_module_state_dict[k], compiled_state_dict[k])
+        # compile does not change the weights, so compare all of them bitwise at once
+        keys = sorted(my_module_state_dict.keys())
+        self.assertTrue(
+            torch.equal(
+                torch.cat([my_module_state_dict[k].reshape(-1) for k in keys]),
+                torch.cat([compiled_state_dict[k].reshape(-1) for k in keys]),
             )
+        )
         self.assertIsNotNone(compiled_module._compiled_call_impl)
 
     @unittest.skipUnless(
@@ -366,11 +382,12 @@ class PrepareModelTest(unittest.TestCase):
         """
         verify error is thrown on invalid backend
         """
+        import torch._dynamo  # noqa
 
         with self.assertRaises(Exception):
             prepare_module(
-                module=torch.nn.Linear(2, 2),
-                device=init_from_env(),
+                module=self._make_linear(),
+                device=_device(),
                 torch_compile_params=TorchCompileParams(backend="foo"),
             )
 
@@ -381,8 +398,8 @@ class PrepareModelTest(unittest.TestCase):
 
         with self.assertRaises(RuntimeError):
             prepare_module(
-                module=torch.nn.Linear(2, 2),
-                device=init_from_env(),
+                module=self._make_linear(),
+                device=_device(),
                 strategy=FSDPStrategy(use_orig_params=False),
                 torch_compile_params=TorchCompileParams(),
             )
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+import torch
+import torch.distributed as dist
+from torchtnt.utils.test_utils import (
+    _get_mp_context,
+    MultiProcessTestRunner,
+    spawn_multi_process,
+)
+
+
+def _get_rank() -> int:
+    return dist.get_rank()
+
+
+def _raise_on_all_ranks() -> None:
+    raise ValueError("failed on all ranks")
+
+
+def _raise_on_rank_1() -> int:
+    if dist.get_rank() == 1:
+        raise ValueError("failed on rank 1")
+    return dist.get_rank()
+
+
+def _sleep(seconds: float) -> str:
+    time.sleep(seconds)
+    return "slow"
+
+
+def _exit_on_rank_1() -> None:
+    if dist.get_rank() == 1:
+        os._exit(3)
+
+
+class MultiProcessTestRunnerTest(unittest.TestCase):
+    distributed_available: bool = torch.distributed.is_available()
+
+    def _make_runner(self, timeout: float = 60.0) -> MultiProcessTestRunner:
+        runner = MultiProcessTestRunner(2, "gloo", timeout=timeout)
+        self.addCleanup(runner.shutdown)
+        return runner
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_run(self) -> None:
+        runner = self._make_runner()
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+        # the process group is reused by later test methods
+        self.assertEqual(runner.run(_sleep, 0), {0: "slow", 1: "slow"})
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_run_raises_on_all_ranks(self) -> None:
+        runner = self._make_runner()
+        with self.assertRaisesRegex(AssertionError, "rank 0:") as cm:
+            runner.run(_raise_on_all_ranks)
+        self.assertIn("rank 1:", str(cm.exception))
+        self.assertIn("ValueError: failed on all ranks", str(cm.exception))
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_run_raises_on_one_rank(self) -> None:
+        runner = self._make_runner()
+        with self.assertRaisesRegex(AssertionError, "rank 1:") as cm:
+            runner.run(_raise_on_rank_1)
+        self.assertNotIn("rank 0:", str(cm.exception))
+        self.assertIn("ValueError: failed on rank 1", str(cm.exception))
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_run_timeout_discards_stale_results(self) -> None:
+        runner = self._make_runner(timeout=3.0)
+        with self.assertRaisesRegex(AssertionError, "Timed out after 3.0s"):
+            runner.run(_sleep, 4)
+        # the results of the timed out test method must not be returned here
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_run_dead_worker(self) -> None:
+        runner = self._make_runner()
+        start = time.monotonic()
+        with self.assertRaisesRegex(AssertionError, "rank 1 exited with exit code 3"):
+            runner.run(_exit_on_rank_1)
+        # fails as soon as the worker died, without waiting for the timeout
+        self.assertLess(time.monotonic() - start, 30)
+        with self.assertRaisesRegex(AssertionError, "rank 1 exited with exit code 3"):
+            runner.run(_get_rank)
+        runner.shutdown()
+        for p in runner._processes:
+            self.assertFalse(p.is_alive())
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_shutdown(self) -> None:
+        runner = self._make_runner()
+        runner.run(_get_rank)
+        runner.shutdown()
+        for p in runner._processes:
+            self.assertFalse(p.is_alive())
+            self.assertEqual(p.exitcode, 0)
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    def test_spawn_multi_process_raises_on_one_rank(self) -> None:
+        start = time.monotonic()
+        with self.assertRaises(Exception):
+            spawn_multi_process(2, "gloo", _raise_on_rank_1)
+        # rank 0 doesn't wait on the failed rank before exiting
+        self.assertLess(time.monotonic() - start, 20)
+
+    @unittest.skipUnless(
+        distributed_available, reason="Torch distributed is needed to run"
+    )
+    @unittest.skipIf(
+        sys.platform == "win32" or torch.cuda.is_available(),
+        reason="fork is only allowed on hosts without CUDA",
+    )
+    def test_fork_start_method(self) -> None:
+        self.assertEqual(_get_mp_context("gloo", None).get_start_method(), "fork")
+        runner = MultiProcessTestRunner(2, "gloo", timeout=60, start_method="fork")
+        self.addCleanup(runner.shutdown)
+        self.assertEqual(runner.run(_get_rank), {0: 0, 1: 1})
+        self.assertEqual(
+            dict(spawn_multi_process(2, "gloo", _get_rank, start_method="fork")),
+            {0: 0, 1: 1},
+        )
+
+    def test_default_start_method_spawns_with_cuda(self) -> None:
+        self.assertEqual(_get_mp_context("nccl", None).get_start_method(), "spawn")
+        with patch("torch.cuda.is_available", return_value=True):
+            self.assertEqual(_get_mp_context("gloo", None).get_start_method(), "spawn")
+
+    def test_fork_start_method_raises_with_cuda(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "Cannot use the fork start method"):
+            MultiProcessTestRunner(2, "nccl", start_method="fork")
+        with patch("torch.cuda.is_available", return_value=True):
+            with self.assertRaisesRegex(
+                RuntimeError, "Cannot use the fork start method"
+            ):
+                MultiProcessTestRunner(2, "gloo", start_method="fork")
+            with self.assertRaisesRegex(
+                RuntimeError, "Cannot use the fork start method"
+            ):
+                spawn_multi_process(2, "gloo", _get_rank, start_method="fork")
@@ -16,6 +16,7 @@ import torch.distributed as dist
 import torch.nn.functional as F
 from torch import Tensor
 from torch.distributed.elastic.utils.distributed import get_free_port
+from torchtnt.utils.version import is_torch_version_geq_1_13
 from typing_extensions import Literal
 
 
@@ -283,11 +284,24 @@ def all_gather_tensors(
     )
     dist.all_gather(local_sizes, local_size, group=group)
 
-    # if the backend is NCCL, we can gather the differently sized tensors without padding
+    # if the backend is NCCL, gather into a single flat buffer padded to the largest
+    # numel, which avoids allocating and copying a list of per-rank output tensors
     if dist.get_backend(group) == "nccl":
-        gathered_result = [result.new_empty(size.tolist()) for size in local_sizes]
-        dist.all_gather(gathered_result, result, group)
-        return gathered_result
+        # a single device to host copy for all the shapes
+        shapes = torch.stack(local_sizes).cpu().tolist()
+        numels = [torch.Size(shape).numel() for shape in shapes]
+        max_numel = max(numels)
+        flat_in = result.new_empty(max_numel)
+        flat_in[: result.numel()].copy_(result.reshape(-1))
+        flat_out = result.new_empty(world_size * max_numel)
+        if is_torch_version_geq_1_13():
+            dist.all_gather_into_tensor(flat_out, flat_in, group=group)
+        else:
+            dist._all_gather_base(flat_out, flat_in, group=group)
+        return [
+            flat_out[idx * max_numel : idx * max_numel + numel].view(shape)
+            for idx, (numel, shape) in enumerate(zip(numels, shapes))
+        ]
 
     # if shapes are all the same, then do a simple gather:
     stacked_sizes = torch.stack(local_sizes)
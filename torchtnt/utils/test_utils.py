@@ -7,11 +7,16 @@
 
 import ctypes
 import os
+import queue
+import sys
+import time
+import traceback
 import unittest
 import uuid
 from functools import wraps
-from typing import Any, Callable, Dict, Optional, TypeVar
+from typing import Any, Callable, Dict, List, Optional, TypeVar
 
+import torch
 import torch.distributed.launcher as pet
 from pyre_extensions import ParameterSpecification
 from torch import distributed as dist, multiprocessing
@@ -72,11 +77,30 @@ def skip_if_asan(
     return wrapper
 
 
+def _get_mp_context(backend: str, start_method: Optional[str]) -> Any:
+    """
+    Get the multiprocessing context to start test workers with. If ``start_method`` is None,
+    fork is used when the workers can't touch CUDA (no NCCL and no CUDA on the host), and spawn otherwise.
+    """
+    # CUDA can't be used in forked children once the driver is initialized in the parent,
+    # which even torch.cuda.is_available() does
+    cuda_unsafe = backend == "nccl" or torch.cuda.is_available()
+    if start_method is None:
+        start_method = "spawn" if sys.platform == "win32" or cuda_unsafe else "fork"
+    elif start_method == "fork" and cuda_unsafe:
+        raise RuntimeError(
+            "Cannot use the fork start method with the NCCL backend or on a CUDA host, "
+            "since CUDA can't be used in forked workers."
+        )
+    return multiprocessing.get_context(start_method)
+
+
 def spawn_multi_process(
     world_size: int,
     backend: str,
     test_method: Callable[TParams, TReturn],
     *args: Any,
+    start_method: Optional[str] = "spawn",
 ) -> Dict[int, TReturn]:
     """
     Spawn single node, multi-rank function.
@@ -87,6 +111,8 @@ def spawn_multi_process(
         backend: backend to use. for example, "nccl", "gloo", etc
         test_method: callable to spawn. first 3 arguments are rank, world_size and mp output dict
         args: additional args for func
+        start_method: multiprocessing start method. "fork" avoids re-importing modules in every
+            process, but is not allowed with NCCL or on a CUDA host. If None, fork is used where allowed
 
     Returns:
         A dictionary of rank -> func return value
@@ -94,11 +120,11 @@ def spawn_multi_process(
     os.environ["MASTER_PORT"] = str(get_free_port())
     os.environ["MASTER_ADDR"] = "127.0.0.1"
 
+    ctx = _get_mp_context(backend, start_method)
     processes = []
     manager = multiprocessing.Manager()
     mp_output_dict = manager.dict()
     tc = unittest.TestCase()
-    ctx = multiprocessing.get_context("spawn")
     for rank in range(world_size):
         p = ctx.Process(
             target=init_pg_and_rank_and_launch_test,
@@ -121,6 +147,11 @@ def spawn_multi_process(
     return mp_output_dict
 
 
+_DONE_KEY = "spawn_multi_process_done"
+# seconds rank 0 waits for the other ranks to finish before shutting down the store
+_DONE_TIMEOUT = 30.0
+
+
 def init_pg_and_rank_and_launch_test(
     test_method: Callable[TParams, TReturn],
     rank: int,
@@ -130,6 +161,198 @@ def init_pg_and_rank_and_launch_test(
     mp_output_dict: Dict[int, Any],
     *args: Any,
 ) -> None:
-    dist.init_process_group(rank=rank, world_size=world_size, backend=backend)
+    # rank 0 hosts the store, so it is created explicitly to let rank 0 keep it
+    # alive until the other ranks are done with it
+    store = dist.TCPStore(
+        os.environ["MASTER_ADDR"],
+        int(os.environ["MASTER_PORT"]),
+        world_size,
+        rank == 0,
+    )
+    dist.init_process_group(
+        rank=rank, world_size=world_size, backend=backend, store=store
+    )
     os.environ["LOCAL_RANK"] = str(rank)
-    mp_output_dict[rank] = test_method(*args)  # pyre-fixme[29]
+    try:
+        mp_output_dict[rank] = test_method(*args)  # pyre-fixme[29]
+    finally:
+        # signalled even if the test method raised, so rank 0 never waits on a
+        # rank that failed
+        store.add(_DONE_KEY, 1)
+    # the wait is bounded in case another rank died without signalling
+    if rank == 0:
+        deadline = time.monotonic() + _DONE_TIMEOUT
+        while store.add(_DONE_KEY, 0) < world_size and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+# seconds between checks that MultiProcessTestRunner workers are still alive
+_POLL_INTERVAL = 1.0
+
+
+class MultiProcessTestRunner:
+    """
+    Single node, multi-rank worker pool which initializes the process group once
+    and runs any number of test methods on it. This avoids paying the process
+    group bootstrap cost for every test method, as :func:`spawn_multi_process` does.
+
+    Test methods are sent to the workers through a queue, so they must be picklable
+    (e.g. module level functions or staticmethods).
+
+    Example:
+
+        >>> runner = MultiProcessTestRunner(2, "gloo")
+        >>> runner.run(my_test_method)
+        >>> runner.run(my_other_test_method, 1, 2)
+        >>> runner.shutdown()
+
+    Args:
+        world_size: number of processes
+        backend: backend to use. for example, "nccl", "gloo", etc
+        timeout: seconds to wait for all ranks to finish a single test method
+        start_method: multiprocessing start method, see :func:`spawn_multi_process`.
+            By default, fork is used where allowed
+    """
+
+    def __init__(
+        self,
+        world_size: int,
+        backend: str,
+        timeout: float = 300.0,
+        start_method: Optional[str] = None,
+    ) -> None:
+        self.world_size = world_size
+        self.backend = backend
+        self.timeout = timeout
+
+        os.environ["MASTER_PORT"] = str(get_free_port())
+        os.environ["MASTER_ADDR"] = "127.0.0.1"
+
+        ctx = _get_mp_context(backend, start_method)
+        self._task_queues: List[Any] = [ctx.Queue() for _ in range(world_size)]
+        self._result_queue: Any = ctx.Queue()
+        self._processes: List[Any] = []
+        self._task_id = 0
+        self._dead_worker_error: Optional[str] = None
+        for rank in range(world_size):
+            p = ctx.Process(
+                target=_multi_process_test_worker,
+                args=(
+                    rank,
+                    world_size,
+                    backend,
+                    self._task_queues[rank],
+                    self._result_queue,
+                ),
+                daemon=True,
+            )
+            p.start()
+            self._processes.append(p)
+
+    def run(
+        self, test_method: Callable[TParams, TReturn], *args: Any
+    ) -> Dict[int, TReturn]:
+        """
+        Run ``test_method`` on every rank and wait for all of them to finish.
+
+        Returns:
+            A dictionary of rank -> test_method return value
+
+        Raises:
+            AssertionError
+                If the test method raised on any rank, a worker died, or the ranks did not finish in time.
+        """
+        if self._dead_worker_error is not None:
+            raise AssertionError(self._dead_worker_error)
+
+        # results are tagged with the task id, so that results of an earlier task
+        # which timed out are discarded instead of being attributed to this one
+        self._task_id += 1
+        task_id = self._task_id
+        for task_queue in self._task_queues:
+            task_queue.put((task_id, test_method, args))
+
+        outputs: Dict[int, TReturn] = {}
+        errors: List[str] = []
+        num_results = 0
+        deadline = time.monotonic() + self.timeout
+        while num_results < self.world_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AssertionError(
+                    f"Timed out after {self.timeout}s waiting for {test_method} to finish on all ranks"
+                )
+            try:
+                result_task_id, rank, ok, value = self._result_queue.get(
+                    timeout=min(remaining, _POLL_INTERVAL)
+                )
+            except queue.Empty:
+                self._check_workers_alive()
+                continue
+            if result_task_id != task_id:
+                continue
+            num_results += 1
+            if ok:
+                outputs[rank] = value
+            else:
+                errors.append(f"rank {rank}:\n{value}")
+        if errors:
+            raise AssertionError("\n".join(errors))
+        return outputs
+
+    def shutdown(self) -> None:
+        """Stop all workers and tear down the process group."""
+        if self._dead_worker_error is None:
+            for task_queue in self._task_queues:
+                task_queue.put(None)
+            deadline = time.monotonic() + self.timeout
+            for p in self._processes:
+                p.join(timeout=max(deadline - time.monotonic(), 0))
+        # once a worker died, the remaining ones may be stuck in a collective
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+    def _check_workers_alive(self) -> None:
+        dead_workers = [
+            f"Worker for rank {rank} exited with exit code {p.exitcode}"
+            for rank, p in enumerate(self._processes)
+            if p.exitcode is not None
+        ]
+        if dead_workers:
+            self._dead_worker_error = "\n".join(dead_workers)
+            raise AssertionError(self._dead_worker_error)
+
+
+def _multi_process_test_worker(
+    rank: int,
+    world_size: int,
+    backend: str,
+    # pyre-fixme[2]
+    task_queue: Any,
+    # pyre-fixme[2]
+    result_queue: Any,
+) -> None:
+    os.environ["LOCAL_RANK"] = str(rank)
+    if backend == "nccl":
+        # pay for CUDA context creation once per worker instead of in the first test
+        device = torch.device("cuda", rank)
+        torch.cuda.set_device(device)
+        torch.empty(1, device=device).add_(1.0)
+        torch.cuda.synchronize(device)
+    dist.init_process_group(rank=rank, world_size=world_size, backend=backend)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            task_id, test_method, args = task
+            dist.barrier()
+            try:
+                result_queue.put((task_id, rank, True, test_method(*args)))
+            except Exception:
+                result_queue.put((task_id, rank, False, traceback.format_exc()))
+            dist.barrier()
+    finally:
+        dist.destroy_process_group()